@@ -0,0 +1,29 @@
+"""
+One-off migration for tables with tickets opened before /entry guarded
+plates: writes the PLATE#<plate> guard row for every active ticket.
+
+Run it once per table from the app image, e.g.
+    docker exec <container> python backfill_plate_guards.py
+then set PLATE_GUARDS_BACKFILLED=true so /entry stops checking the GSI.
+"""
+import asyncio
+import logging
+
+from db import DynamoDBTicketStore
+
+logger = logging.getLogger(__name__)
+
+
+async def main() -> None:
+    store = DynamoDBTicketStore()
+    await store.connect()
+    try:
+        written = await store.backfill_plate_guards()
+    finally:
+        await store.close()
+    logger.info("Wrote %d plate guards to %s", written, store.table_name)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
@@ -1,109 +1,530 @@
+import asyncio
 import os
 import logging
-from typing import Dict, Optional, Any
-from decimal import Decimal
+from contextlib import AsyncExitStack
+from typing import Dict, List, Optional, Any
 
-import boto3
-from botocore.exceptions import ClientError
-from boto3.dynamodb.conditions import Key, Attr
-from mypy_boto3_dynamodb import DynamoDBServiceResource
-from mypy_boto3_dynamodb.service_resource import Table
+import aioboto3
+from aiobotocore.config import AioConfig
+from botocore.exceptions import BotoCoreError, ClientError
+from boto3.dynamodb.types import TypeDeserializer
 
 logger = logging.getLogger(__name__)
 
+# Used by the one client each worker opens in main.py's lifespan handler.
+# max_pool_connections is the connection pool *size* (sockets kept per host),
+# not the number of pools; DynamoDB is a single host, so this caps how many
+# calls can be in flight at once without opening throwaway connections.
+BOTO_CONFIG = AioConfig(
+    max_pool_connections=64,
+    connector_args={"keepalive_timeout": 30},
+    retries={"max_attempts": 5, "mode": "adaptive"},
+    connect_timeout=1,
+    read_timeout=2,
+)
+
+# The store talks to the low-level client and writes AttributeValue dicts
+# by hand; only items coming back are run through the deserializer.
+_DESERIALIZER = TypeDeserializer()
+
+# What /exit reads: enough to bill the ticket and release its plate guard
+EXIT_ATTRIBUTES = "ticket_id, license_plate, entry_time, entry_epoch, parking_lot, payment_status"
+
+# BatchGetItem accepts at most 100 keys per request
+MAX_BATCH_GET_KEYS = 100
+# Requests per batch, retries of UnprocessedKeys included, before the
+# still-unprocessed callers fail instead of waiting out the throttling
+MAX_BATCH_GET_ATTEMPTS = 5
+
+# A guard row keyed by plate exists while that plate has an active ticket.
+# It carries no license_plate attribute, so it stays out of the GSI.
+PLATE_GUARD_PREFIX = "PLATE#"
+
+# GSI over license_plate; still consulted for tickets that predate guards
+LICENSE_PLATE_INDEX = "license_plate-index"
+
+
+class PlateAlreadyParked(Exception):
+    """
+    Raised by create_ticket when the plate already has an active ticket
+    """
+
+
+def is_conditional_check_failure(error: ClientError) -> bool:
+    """
+    True if a write (plain or transactional) was rejected by its condition
+    """
+    code = error.response["Error"]["Code"]
+    if code == "ConditionalCheckFailedException":
+        return True
+    if code == "TransactionCanceledException":
+        return any(
+            reason.get("Code") == "ConditionalCheckFailed"
+            for reason in error.response.get("CancellationReasons", [])
+        )
+    return False
+
+
+def _guard_held_by_other_ticket(error: ClientError) -> bool:
+    """
+    True if an exit transaction failed only on its plate guard delete, i.e.
+    the ticket is still active but the guard names a different ticket
+    """
+    if error.response["Error"]["Code"] != "TransactionCanceledException":
+        return False
+    codes = [reason.get("Code") for reason in error.response.get("CancellationReasons", [])]
+    return codes == ["None", "ConditionalCheckFailed"]
+
+
+def _deserialize(raw: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: _DESERIALIZER.deserialize(v) for k, v in raw.items()}
+
+
+def conditional_check_item(error: ClientError) -> Optional[Dict[str, Any]]:
+    """
+    The item a failed condition was checked against, as returned for writes
+    sent with ReturnValuesOnConditionCheckFailure=ALL_OLD.
+    None if the item does not exist (or is a plate guard row).
+    """
+    raw = error.response.get("Item")
+    if raw is None:
+        raw = next(
+            (
+                reason.get("Item")
+                for reason in error.response.get("CancellationReasons", [])
+                if reason.get("Code") == "ConditionalCheckFailed"
+            ),
+            None,
+        )
+    if not raw:
+        return None
+    item = _deserialize(raw)
+    if item["ticket_id"].startswith(PLATE_GUARD_PREFIX):
+        return None
+    return item
+
+
+class _BatchGetLoader:
+    """
+    Coalesces concurrent single-ticket reads into BatchGetItem calls.
+
+    Keys requested within `window` seconds of each other (or until
+    MAX_BATCH_GET_KEYS are queued) share one request; each caller awaits
+    its own future and receives the raw item, or None if it does not exist.
+    A projection, if given, must include ticket_id.
+    """
+
+    def __init__(
+        self, client, table_name: str, window: float, projection: Optional[str] = None
+    ):
+        self._client = client
+        self._table_name = table_name
+        self._window = window
+        self._projection = projection
+        self._pending: Dict[str, List[asyncio.Future]] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        # Strong references so in-flight loads are not garbage collected
+        self._loads: set = set()
+
+    async def get(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(ticket_id, []).append(future)
+        if len(self._pending) >= MAX_BATCH_GET_KEYS:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._window, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._load(batch))
+            self._loads.add(task)
+            task.add_done_callback(self._loads.discard)
+
+    async def _load(self, batch: Dict[str, List[asyncio.Future]]) -> None:
+        items: Dict[str, Dict[str, Any]] = {}
+        keys_and_attributes: Dict[str, Any] = {
+            "Keys": [{"ticket_id": {"S": ticket_id}} for ticket_id in batch]
+        }
+        if self._projection:
+            keys_and_attributes["ProjectionExpression"] = self._projection
+        request = {self._table_name: keys_and_attributes}
+        # Keys with no answer yet; they get `error` if the batch gives up
+        unanswered = set(batch)
+        error: Optional[Exception] = None
+        try:
+            for attempt in range(MAX_BATCH_GET_ATTEMPTS):
+                if attempt:
+                    # Throttled keys come back unprocessed rather than as errors
+                    await asyncio.sleep(min(0.005 * 2 ** attempt, 0.2))
+                resp = await self._client.batch_get_item(RequestItems=request)
+                for raw in resp["Responses"].get(self._table_name, []):
+                    items[raw["ticket_id"]["S"]] = raw
+                request = resp.get("UnprocessedKeys")
+                if not request:
+                    unanswered.clear()
+                    break
+                unanswered = {key["ticket_id"]["S"] for key in request[self._table_name]["Keys"]}
+            else:
+                error = ClientError(
+                    {
+                        "Error": {
+                            "Code": "ProvisionedThroughputExceededException",
+                            "Message": f"{len(unanswered)} keys still unprocessed after {MAX_BATCH_GET_ATTEMPTS} BatchGetItem attempts",
+                        }
+                    },
+                    "BatchGetItem",
+                )
+        except Exception as e:
+            error = e
+
+        for ticket_id, futures in batch.items():
+            for future in futures:
+                if future.done():
+                    continue
+                if ticket_id in unanswered:
+                    future.set_exception(error)
+                else:
+                    future.set_result(items.get(ticket_id))
+
 
 class DynamoDBTicketStore:
     """
     Handles interactions with DynamoDB for parking ticket management
+
+    Uses one low-level aioboto3 client for the whole app lifetime, so
+    DynamoDB round-trips never block the event loop. Call connect() on
+    startup and close() on shutdown.
     """
 
     def __init__(self):
         self.region = os.getenv("AWS_REGION", "eu-central-1")
         self.table_name = os.getenv("DYNAMODB_TABLE", "parking-tickets")
+        # Hedged reads: re-issue a GetItem that is slower than the delay
+        self.hedged_reads = os.getenv("HEDGED_READS", "false").lower() == "true"
+        self.hedge_delay = int(os.getenv("HEDGE_DELAY_MS", "30")) / 1000
+        # Micro-batching: coalesce reads arriving within the window
+        self.batch_gets = os.getenv("BATCH_GETS", "false").lower() == "true"
+        self.batch_window = int(os.getenv("BATCH_WINDOW_MS", "2")) / 1000
+        # Set once backfill_plate_guards() has run against the table; until
+        # then /entry also checks the GSI for tickets opened before guards
+        self.plate_guards_backfilled = (
+            os.getenv("PLATE_GUARDS_BACKFILLED", "false").lower() == "true"
+        )
+
+        self._session = aioboto3.Session()
+        self._exit_stack = AsyncExitStack()
+        # One loader per projection, since a BatchGetItem shares a single one
+        self._batch_loaders: Dict[Optional[str], _BatchGetLoader] = {}
+        self.client = None
 
-        self.dynamodb: DynamoDBServiceResource = boto3.resource(
-            "dynamodb", region_name=self.region
+    async def connect(self) -> None:
+        self.client = await self._exit_stack.enter_async_context(
+            self._session.client(
+                "dynamodb", region_name=self.region, config=BOTO_CONFIG
+            )
         )
-        self.table: Table = self.dynamodb.Table(self.table_name)
-        logger.info(f"Initialized DynamoDB connection to table: {self.table_name}")
+        # Pay credential resolution, endpoint lookup, signing setup and the
+        # TLS handshake now rather than on the first user request
+        try:
+            await self.client.describe_table(TableName=self.table_name)
+        except (ClientError, BotoCoreError) as e:
+            logger.warning("DynamoDB warm-up failed for %s: %s", self.table_name, e)
+        logger.info("Initialized DynamoDB connection to table: %s", self.table_name)
 
-    def create_ticket(
-        self, ticket_id: str, license_plate: str, entry_time: str
+    async def close(self) -> None:
+        await self._exit_stack.aclose()
+
+    async def create_ticket(
+        self,
+        ticket_id: str,
+        license_plate: str,
+        entry_time: str,
+        entry_epoch: int,
+        parking_lot: str,
     ) -> Dict[str, Any]:
+        """
+        Opens a ticket and reserves its plate guard in one transaction.
+        Raises PlateAlreadyParked if the plate already has an active ticket.
+        """
         item = {
             "ticket_id": ticket_id,
             "license_plate": license_plate,
             "entry_time": entry_time,
+            "entry_epoch": entry_epoch,
+            "parking_lot": parking_lot,
             "payment_status": "active",
         }
+        guard = {
+            "ticket_id": {"S": f"{PLATE_GUARD_PREFIX}{license_plate}"},
+            "active_ticket_id": {"S": ticket_id},
+        }
         try:
-            self.table.put_item(Item=item)
-            logger.info(f"Created ticket {ticket_id} for license plate {license_plate}")
+            if not self.plate_guards_backfilled and await self._has_active_ticket_in_index(license_plate):
+                raise PlateAlreadyParked(license_plate)
+            # One round-trip: the guard insert fails if the plate is parked
+            await self.client.transact_write_items(
+                TransactItems=[
+                    {
+                        "Put": {
+                            "TableName": self.table_name,
+                            "Item": guard,
+                            "ConditionExpression": "attribute_not_exists(ticket_id)",
+                        }
+                    },
+                    {
+                        "Put": {
+                            "TableName": self.table_name,
+                            "Item": {
+                                "ticket_id": {"S": ticket_id},
+                                "license_plate": {"S": license_plate},
+                                "entry_time": {"S": entry_time},
+                                "entry_epoch": {"N": str(entry_epoch)},
+                                "parking_lot": {"S": parking_lot},
+                                "payment_status": {"S": "active"},
+                            },
+                        }
+                    },
+                ],
+            )
+            logger.debug("Created ticket %s for license plate %s", ticket_id, license_plate)
             return item
         except ClientError as e:
-            logger.error(f"Failed to create ticket: {e}")
+            if is_conditional_check_failure(e):
+                raise PlateAlreadyParked(license_plate) from e
+            logger.error("Failed to create ticket: %s", e)
             raise
 
-    def get_ticket(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+    async def _has_active_ticket_in_index(self, license_plate: str) -> bool:
+        """
+        Looks for an active ticket through the GSI, which also sees tickets
+        created before plate guards existed. Only the match count comes back;
+        Limit is left out since it would apply before the filter.
+        """
+        params: Dict[str, Any] = {
+            "TableName": self.table_name,
+            "IndexName": LICENSE_PLATE_INDEX,
+            "KeyConditionExpression": "license_plate = :plate",
+            "FilterExpression": "payment_status = :active",
+            "ExpressionAttributeValues": {
+                ":plate": {"S": license_plate},
+                ":active": {"S": "active"},
+            },
+            "Select": "COUNT",
+        }
+        while True:
+            resp = await self.client.query(**params)
+            if resp["Count"] > 0:
+                return True
+            if "LastEvaluatedKey" not in resp:
+                return False
+            params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+    async def backfill_plate_guards(self) -> int:
+        """
+        Writes the PLATE#<plate> guard row for every active ticket created
+        before guards existed. Safe to re-run; returns the number written.
+        Each guard is written together with a check that its ticket is still
+        active, so a ticket that exits mid-scan never leaves a stale guard.
+        """
+        written = 0
+        params: Dict[str, Any] = {
+            "TableName": self.table_name,
+            "FilterExpression": "payment_status = :active",
+            "ProjectionExpression": "ticket_id, license_plate",
+            "ExpressionAttributeValues": {":active": {"S": "active"}},
+        }
+        while True:
+            resp = await self.client.scan(**params)
+            for raw in resp["Items"]:
+                ticket_id = raw["ticket_id"]["S"]
+                license_plate = raw["license_plate"]["S"]
+                try:
+                    await self.client.transact_write_items(
+                        TransactItems=[
+                            {
+                                "Put": {
+                                    "TableName": self.table_name,
+                                    "Item": {
+                                        "ticket_id": {"S": f"{PLATE_GUARD_PREFIX}{license_plate}"},
+                                        "active_ticket_id": {"S": ticket_id},
+                                    },
+                                    "ConditionExpression": "attribute_not_exists(ticket_id)",
+                                    "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+                                }
+                            },
+                            {
+                                "ConditionCheck": {
+                                    "TableName": self.table_name,
+                                    "Key": {"ticket_id": {"S": ticket_id}},
+                                    "ConditionExpression": "payment_status = :active",
+                                    "ExpressionAttributeValues": {":active": {"S": "active"}},
+                                }
+                            },
+                        ],
+                    )
+                    written += 1
+                except ClientError as e:
+                    if not is_conditional_check_failure(e):
+                        raise
+                    guard = e.response["CancellationReasons"][0].get("Item")
+                    holder = guard["active_ticket_id"]["S"] if guard else ticket_id
+                    if holder != ticket_id:
+                        logger.warning(
+                            "Plate %s has two active tickets, %s and %s; close one of them",
+                            license_plate, holder, ticket_id,
+                        )
+            if "LastEvaluatedKey" not in resp:
+                return written
+            params["ExclusiveStartKey"] = resp["LastEvaluatedKey"]
+
+    async def _get_item(
+        self, ticket_id: str, projection: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        GetItem, optionally hedged: if the first request has not answered
+        within hedge_delay, send a duplicate and take whichever returns
+        first. Trims the straggler tail for a small extra read cost.
+        With batching enabled the read joins the next BatchGetItem instead.
+        """
+        if self.batch_gets:
+            loader = self._batch_loaders.get(projection)
+            if loader is None:
+                loader = self._batch_loaders[projection] = _BatchGetLoader(
+                    self.client, self.table_name, self.batch_window, projection
+                )
+            raw = await loader.get(ticket_id)
+            return {} if raw is None else {"Item": raw}
+
+        params: Dict[str, Any] = {
+            "TableName": self.table_name,
+            "Key": {"ticket_id": {"S": ticket_id}},
+        }
+        if projection:
+            params["ProjectionExpression"] = projection
+
+        def request():
+            return self.client.get_item(**params)
+
+        if not self.hedged_reads:
+            return await request()
+
+        tasks = {asyncio.create_task(request())}
         try:
-            resp = self.table.get_item(Key={"ticket_id": ticket_id})
-            return resp.get("Item")
-        except ClientError as e:
-            logger.error(f"Error fetching ticket {ticket_id}: {e}")
-            raise
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay)
+            if not done:
+                tasks.add(asyncio.create_task(request()))
+                done, _ = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+            return done.pop().result()
+        finally:
+            for task in tasks:
+                task.cancel()
 
-    def update_ticket_exit(
-        self, ticket_id: str, exit_time: str, fee: Decimal
+    async def get_ticket(
+        self, ticket_id: str, projection: Optional[str] = None
     ) -> Optional[Dict[str, Any]]:
+        """
+        Fetches a ticket, or only the attributes named in `projection`
+        """
+        if ticket_id.startswith(PLATE_GUARD_PREFIX):
+            return None
         try:
-            resp = self.table.update_item(
-                Key={"ticket_id": ticket_id},
-                ConditionExpression=Attr("payment_status").eq("active"),
-                UpdateExpression="SET exit_time = :exit_time, fee = :fee, payment_status = :payment_status, currency = :currency",
-                ExpressionAttributeValues={
-                    ":exit_time": exit_time,
-                    ":fee": fee,
-                    ":payment_status": "pending_payment",
-                    ":currency": "USD",
-                },
-                ReturnValues="ALL_NEW",
-            )
-            logger.info(f"Updated ticket {ticket_id} with exit time and fee {fee} USD")
-            return resp.get("Attributes")
+            resp = await self._get_item(ticket_id, projection)
+            if "Item" not in resp:
+                return None
+            return _deserialize(resp["Item"])
         except ClientError as e:
-            logger.error(f"Error updating ticket {ticket_id}: {e}")
+            logger.error("Error fetching ticket %s: %s", ticket_id, e)
             raise
 
-    def mark_ticket_paid(self, ticket_id: str, tx_id: str) -> Dict[str, Any]:
+    async def get_ticket_for_exit(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        return await self.get_ticket(ticket_id, projection=EXIT_ATTRIBUTES)
+
+    async def update_ticket_exit(
+        self,
+        ticket_id: str,
+        license_plate: str,
+        exit_time: str,
+        exit_epoch: int,
+        fee_cents: int,
+    ) -> None:
+        """
+        Closes an active ticket and releases its plate guard atomically.
+        Tickets created before the guard existed have none; deleting a
+        missing guard is a no-op, and a guard since taken by a newer ticket
+        for the same plate is left alone.
+        """
+        update = {
+            "TableName": self.table_name,
+            "Key": {"ticket_id": {"S": ticket_id}},
+            "ConditionExpression": "payment_status = :active",
+            "ReturnValuesOnConditionCheckFailure": "ALL_OLD",
+            "UpdateExpression": "SET exit_time = :exit_time, exit_epoch = :exit_epoch, fee_cents = :fee_cents, payment_status = :payment_status, currency = :currency",
+            "ExpressionAttributeValues": {
+                ":active": {"S": "active"},
+                ":exit_time": {"S": exit_time},
+                ":exit_epoch": {"N": str(exit_epoch)},
+                ":fee_cents": {"N": str(fee_cents)},
+                ":payment_status": {"S": "pending_payment"},
+                ":currency": {"S": "USD"},
+            },
+        }
         try:
-            resp = self.table.update_item(
-                Key={"ticket_id": ticket_id},
-                UpdateExpression="SET payment_status = :paid, tx_id = :tx",
-                ExpressionAttributeValues={
-                    ":paid": "paid",
-                    ":tx": tx_id,
-                },
-                ReturnValues="ALL_NEW",
-            )
-            return resp["Attributes"]
+            try:
+                await self.client.transact_write_items(
+                    TransactItems=[
+                        {"Update": update},
+                        {
+                            "Delete": {
+                                "TableName": self.table_name,
+                                "Key": {"ticket_id": {"S": f"{PLATE_GUARD_PREFIX}{license_plate}"}},
+                                "ConditionExpression": "attribute_not_exists(ticket_id) OR active_ticket_id = :ticket_id",
+                                "ExpressionAttributeValues": {":ticket_id": {"S": ticket_id}},
+                            }
+                        },
+                    ],
+                )
+            except ClientError as e:
+                if not _guard_held_by_other_ticket(e):
+                    raise
+                # An active ticket whose guard belongs to another ticket was
+                # opened before guards existed: close it and leave that guard
+                logger.warning("Ticket %s has no plate guard; closing it alone", ticket_id)
+                await self.client.update_item(**update)
+            logger.debug("Updated ticket %s with exit time and fee %s cents", ticket_id, fee_cents)
         except ClientError as e:
-            logger.error(f"Could not mark ticket {ticket_id} paid: {e}")
+            logger.error("Error updating ticket %s: %s", ticket_id, e)
             raise
 
-    def is_license_plate_parked(self, license_plate: str) -> bool:
+    async def mark_ticket_paid(self, ticket_id: str, tx_id: str) -> Dict[str, Any]:
         """
-        Returns True if license_plate currently has an *active* ticket.
-        Uses the GSI `license_plate-index`.
+        Settles a ticket awaiting payment in a single round-trip.
+        If the ticket is missing or not pending payment the condition fails;
+        use conditional_check_item() on the error to see why.
         """
         try:
-            resp = self.table.query(
-                IndexName="license_plate-index",
-                KeyConditionExpression=Key("license_plate").eq(license_plate),
-                FilterExpression=Attr("payment_status").eq("active"),
+            resp = await self.client.update_item(
+                TableName=self.table_name,
+                Key={"ticket_id": {"S": ticket_id}},
+                ConditionExpression="payment_status = :pending",
+                UpdateExpression="SET payment_status = :paid, tx_id = :tx",
+                ExpressionAttributeValues={
+                    ":pending": {"S": "pending_payment"},
+                    ":paid": {"S": "paid"},
+                    ":tx": {"S": tx_id},
+                },
+                ReturnValues="ALL_NEW",
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
             )
-            parked = bool(resp.get("Items"))
-            logger.info(f"License plate {license_plate} parked: {parked}")
-            return parked
+            return _deserialize(resp["Attributes"])
         except ClientError as e:
-            logger.error(f"Error checking plate {license_plate}: {e}")
+            if not is_conditional_check_failure(e):
+                logger.error("Could not mark ticket %s paid: %s", ticket_id, e)
             raise
@@ -2,28 +2,39 @@ from __future__ import annotations
 
 import logging
 import os
-import json
 import sys
 import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Annotated
 
+import orjson
 import uvicorn
-from fastapi import FastAPI, Query, status
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, Query, Request, status
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, Response
 from botocore.exceptions import ClientError
 
-from db import DynamoDBTicketStore
+from db import (
+    DynamoDBTicketStore,
+    PlateAlreadyParked,
+    conditional_check_item,
+    is_conditional_check_failure,
+)
 from utils import (
     calculate_parking_fee,
     generate_ticket_id,
-    get_current_time,
-    validate_license_plate_format
+    get_current_timestamp,
+    iso_to_epoch,
 )
 
 # Configure logging
 class JsonFormatter(logging.Formatter):
     def format(self, record):
         log_data = {
-            "timestamp": self.formatTime(record),
+            # record.created is already a Unix timestamp; skip strftime
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
             "level": record.levelname,
             "message": record.getMessage(),
             "module": record.module,
@@ -32,28 +43,82 @@ class JsonFormatter(logging.Formatter):
         # Add exception info if present
         if record.exc_info:
             log_data["exception"] = self.formatException(record.exc_info)
-        return json.dumps(log_data)
+        return orjson.dumps(log_data).decode()
 
 # Setup logger
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
 handler = logging.StreamHandler(sys.stdout)
 handler.setFormatter(JsonFormatter())
 logger.addHandler(handler)
 
+# DynamoDB store, created per worker on startup rather than at import
+ticket_store: DynamoDBTicketStore | None = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global ticket_store
+    ticket_store = DynamoDBTicketStore()
+    await ticket_store.connect()
+    try:
+        yield
+    finally:
+        await ticket_store.close()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Parking Lot Management System",
     description="API for managing parking lot entries, exits, and fee calculations",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
 # Log the configuration
-logger.info(f"Starting application with AWS region: {os.getenv('AWS_REGION', 'eu-central-1')}")
-logger.info(f"Using DynamoDB table: {os.getenv('DYNAMODB_TABLE', 'parking-tickets')}")
+logger.info("Starting application with AWS region: %s", os.getenv('AWS_REGION', 'eu-central-1'))
+logger.info("Using DynamoDB table: %s", os.getenv('DYNAMODB_TABLE', 'parking-tickets'))
+
+# Error bodies are prebuilt at import: the constant one is a shared response,
+# the parameterized ones are byte templates filled with a JSON-escaped value
+_INTERNAL_ERROR = ORJSONResponse(
+    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+    content={"detail": "Internal server error"}
+)
+_INVALID_PLATE = b'{"detail":"Invalid license plate format: %b"}'
+_PLATE_PARKED = b'{"detail":"Vehicle with license plate %b is already parked"}'
+_TICKET_NOT_FOUND = b'{"detail":"Ticket %b not found"}'
+_EXIT_ALREADY_PROCESSED = b'{"detail":"Exit request for ticket %b was already processed"}'
+_TICKET_ALREADY_PAID = b'{"detail":"Ticket %b is already paid"}'
+_TICKET_ALREADY_SETTLED = b'{"detail":"Ticket %b is already settled"}'
+_UNEXPECTED_STATE = b'{"detail":"Ticket is in unexpected state %b"}'
+
+def _detail_response(status_code: int, template: bytes, value: str) -> Response:
+    # orjson escapes the value; strip the quotes it wraps around strings
+    return Response(
+        content=template % orjson.dumps(str(value))[1:-1],
+        status_code=status_code,
+        media_type="application/json",
+    )
 
-# Initialize DynamoDB store
-ticket_store: DynamoDBTicketStore = DynamoDBTicketStore()
+# Accepted formats: 123-45-678, 123-456-789, 12-345-67; matched by pydantic-core
+# while parsing the query, so /entry never sees a malformed plate
+PlateQuery = Annotated[str, Query(
+    description="License plate for entry",
+    pattern=r"^(?:\d{3}-\d{2}-\d{3}|\d{3}-\d{3}-\d{3}|\d{2}-\d{3}-\d{2})$",
+)]
+
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    # Keep the documented 400 for a malformed plate; anything else stays a 422
+    for error in exc.errors():
+        if error["type"] == "string_pattern_mismatch" and tuple(error["loc"]) == ("query", "plate"):
+            logger.warning("Invalid license plate format: %s", error["input"])
+            return _detail_response(status.HTTP_400_BAD_REQUEST, _INVALID_PLATE, error["input"])
+    return await request_validation_exception_handler(request, exc)
+
+# async so FastAPI resolves it inline instead of via the threadpool
+async def get_ticket_store() -> DynamoDBTicketStore:
+    return ticket_store
 
 @app.get("/health")
 async def health_check():
@@ -64,8 +129,9 @@ async def health_check():
 
 @app.post("/entry")
 async def entry_endpoint(
-    plate: str = Query(..., description="License plate for entry"),
-    parkingLot: str = Query(..., description="Parking lot identifier for entry")
+    plate: PlateQuery,
+    parkingLot: str = Query(..., description="Parking lot identifier for entry"),
+    store: DynamoDBTicketStore = Depends(get_ticket_store),
 ):
     """
     Entry endpoint following the exact format from the assignment:
@@ -73,51 +139,29 @@ async def entry_endpoint(
 
     Returns ticket ID
     """
-    logger.info(f"Entry request for plate: {plate} at parking lot: {parkingLot}")
-    if not validate_license_plate_format(plate):
-        logger.warning(f"Invalid license plate format: {plate}")
-        return JSONResponse(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            content={"detail": f"Invalid license plate format: {plate}"}
-        )
-
+    logger.debug("Entry request for plate: %s at parking lot: %s", plate, parkingLot)
     try:
-        # Check if license plate is already parked
-        if ticket_store.is_license_plate_parked(plate):
-            return JSONResponse(
-                status_code=status.HTTP_409_CONFLICT,
-                content={"detail": f"Vehicle with license plate {plate} is already parked"}
-            )
-
         # Create new ticket
         ticket_id = generate_ticket_id()
-        entry_time = get_current_time()
-
-        # Create the ticket
-        ticket_store.create_ticket(ticket_id, plate, entry_time)
+        entry_time, entry_epoch = get_current_timestamp()
 
-        try:
-            ticket_store.table.update_item(
-                Key={'ticket_id': ticket_id},
-                UpdateExpression='SET parking_lot = :pl',
-                ExpressionAttributeValues={':pl': parkingLot}
-            )
-        except Exception as e:
-            logger.warning(f"Could not add parking lot info to ticket: {e}")
+        # Create the ticket; rejected by the plate guard if already parked
+        await store.create_ticket(ticket_id, plate, entry_time, entry_epoch, parkingLot)
 
         # Simply return the ticket ID as specified in the assignment
         return {"ticketId": ticket_id}
 
+    except PlateAlreadyParked:
+        return _detail_response(status.HTTP_409_CONFLICT, _PLATE_PARKED, plate)
+
     except Exception as e:
-        logger.error(f"Error creating entry: {str(e)}")
-        return JSONResponse(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            content={"detail": "Internal server error"}
-        )
+        logger.error("Error creating entry: %s", e)
+        return _INTERNAL_ERROR
 
 @app.post("/exit")
 async def exit_endpoint(
-    ticketId: str = Query(..., description="Ticket ID for exit")
+    ticketId: str = Query(..., description="Ticket ID for exit"),
+    store: DynamoDBTicketStore = Depends(get_ticket_store),
 ):
     """
     Exit endpoint following the exact format from the assignment:
@@ -125,100 +169,100 @@ async def exit_endpoint(
 
     Returns the license plate, total parked time, parking lot ID and the charge
     """
-    logger.info(f"Exit request for ticket: {ticketId}")
+    logger.debug("Exit request for ticket: %s", ticketId)
     try:
-        ticket = ticket_store.get_ticket(ticketId)
+        ticket = await store.get_ticket_for_exit(ticketId)
 
         if not ticket:
-            return JSONResponse(
-                status_code=status.HTTP_404_NOT_FOUND, 
-                content={"detail": f"Ticket {ticketId} not found"}
-            )
+            return _detail_response(status.HTTP_404_NOT_FOUND, _TICKET_NOT_FOUND, ticketId)
 
         if ticket.get("payment_status") == "pending_payment":
-            return JSONResponse(
-                status_code=status.HTTP_409_CONFLICT, 
-                content={"detail": f"Exit request for ticket {ticketId} was already processed"}
-            )
+            return _detail_response(status.HTTP_409_CONFLICT, _EXIT_ALREADY_PROCESSED, ticketId)
 
         if ticket.get("payment_status") == "paid":
-            return JSONResponse(
-                status_code=status.HTTP_409_CONFLICT, 
-                content={"detail": f"Ticket {ticketId} is already paid"}
-            )
+            return _detail_response(status.HTTP_409_CONFLICT, _TICKET_ALREADY_PAID, ticketId)
 
-        exit_time = get_current_time()
-        fee, fee_details = calculate_parking_fee(ticket["entry_time"], exit_time)
+        exit_time, exit_epoch = get_current_timestamp()
+        # Tickets opened before entry_epoch was stored only carry the ISO string
+        entry_epoch = (
+            int(ticket["entry_epoch"]) if "entry_epoch" in ticket
+            else iso_to_epoch(ticket["entry_time"])
+        )
+        fee_cents, fee_details = calculate_parking_fee(entry_epoch, exit_epoch)
 
         # Update ticket with exit information
-        updated_ticket = ticket_store.update_ticket_exit(ticketId, exit_time, fee)
+        await store.update_ticket_exit(
+            ticketId, ticket["license_plate"], exit_time, exit_epoch, fee_cents
+        )
 
-        logger.info(f"Processed exit for ticket {ticketId}, fee: ${fee} USD")
+        logger.debug("Processed exit for ticket %s, fee: %s cents", ticketId, fee_cents)
 
         # Return format matching the assignment requirement
         return {
-            "licensePlate": updated_ticket["license_plate"],
+            "licensePlate": ticket["license_plate"],
             "totalParkedTime": fee_details["duration_minutes"],
             "parkingLot": ticket.get("parking_lot", "N/A"),
-            "charge": fee
+            "charge": fee_cents / 100
         }
 
     except Exception as e:
-        logger.error(f"Error processing exit: {str(e)}")
+        logger.error("Error processing exit: %s", e)
 
-        if isinstance(e, ClientError) and e.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            return JSONResponse(
-                status_code=status.HTTP_409_CONFLICT,
-                content={"detail": f"Exit request for ticket {ticketId} was already processed"},
-            )
+        if isinstance(e, ClientError) and is_conditional_check_failure(e):
+            # Lost a race with a concurrent /exit or /pay; report what won
+            current = conditional_check_item(e)
+            if current and current.get("payment_status") == "paid":
+                return _detail_response(status.HTTP_409_CONFLICT, _TICKET_ALREADY_PAID, ticketId)
+            return _detail_response(status.HTTP_409_CONFLICT, _EXIT_ALREADY_PROCESSED, ticketId)
 
-        return JSONResponse(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            content={"detail": "Internal server error"}
-        )
+        return _INTERNAL_ERROR
 
 @app.post("/pay")
 async def pay_endpoint(
     ticketId: str = Query(..., description="Ticket ID to settle"),
+    store: DynamoDBTicketStore = Depends(get_ticket_store),
 ):
     """
     Stub payment endpoint.
     Accepts *any* `mockPaymentToken`, charges the amount that `/exit`
     recorded, and moves the ticket to *paid*.
+
+    The conditional update is the only DynamoDB call on the happy path;
+    the ticket state is read back from the error only when it is rejected.
     """
-    ticket = ticket_store.get_ticket(ticketId)
-    if not ticket:
-        logger.warning(f"Ticket {ticketId} not found")
-        return JSONResponse(
-            status_code=status.HTTP_404_NOT_FOUND,
-            content={"detail": f"Ticket {ticketId} not found"}
-        )
+    fake_tx_id = f"tx-{uuid.uuid4()}"      # pretend the PSP returned this
 
-    if ticket["payment_status"] == "paid":
-        logger.warning(f"Ticket {ticketId} already paid")
-        return JSONResponse(
-            status_code=status.HTTP_409_CONFLICT,
-            content={"detail": f"Ticket {ticketId} is already settled"}
-        )
-    if ticket["payment_status"] != "pending_payment":
-        logger.warning(f"Ticket {ticketId} is in unexpected state: {ticket['payment_status']}")
-        return JSONResponse(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            content={"detail": f"Ticket is in unexpected state {ticket['payment_status']}"}
+    try:
+        updated = await store.mark_ticket_paid(
+            ticket_id=ticketId,
+            tx_id=fake_tx_id
         )
+    except ClientError as e:
+        if not is_conditional_check_failure(e):
+            raise
+        ticket = conditional_check_item(e)
 
-    fake_tx_id = f"tx-{uuid.uuid4()}"      # pretend the PSP returned this
+        if not ticket:
+            logger.warning("Ticket %s not found", ticketId)
+            return _detail_response(status.HTTP_404_NOT_FOUND, _TICKET_NOT_FOUND, ticketId)
 
-    updated = ticket_store.mark_ticket_paid(
-        ticket_id=ticketId,
-        tx_id=fake_tx_id
-    )
-    logger.info(f"Processed payment for ticket {ticketId}, transaction ID: {fake_tx_id}, {updated}")
+        if ticket["payment_status"] == "paid":
+            logger.warning("Ticket %s already paid", ticketId)
+            return _detail_response(status.HTTP_409_CONFLICT, _TICKET_ALREADY_SETTLED, ticketId)
+
+        logger.warning("Ticket %s is in unexpected state: %s", ticketId, ticket['payment_status'])
+        return _detail_response(status.HTTP_400_BAD_REQUEST, _UNEXPECTED_STATE, ticket['payment_status'])
+
+    logger.debug("Processed payment for ticket %s, transaction ID: %s, %s", ticketId, fake_tx_id, updated)
 
     return {
         "ticketId": ticketId,
         "licensePlate": updated["license_plate"],
-        "charged": ticket["fee"],
+        # Tickets exited before fees were stored in cents carry "fee"
+        "charged": (
+            int(updated["fee_cents"]) / 100 if "fee_cents" in updated
+            else updated["fee"]
+        ),
         "currency": "USD",
         "transactionId": fake_tx_id,
         "payment_status": "paid"
@@ -226,6 +270,20 @@ async def pay_endpoint(
 
 
 if __name__ == "__main__":
-    # Run the app directly when executed as a script
+    # Run the app directly when executed as a script; RELOAD=1 for local dev
     port = int(os.getenv("PORT", "8000"))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
+    reload = os.getenv("RELOAD") == "1"
+    # Stateless API: one asyncio worker process per core sidesteps the GIL;
+    # each worker builds its own DynamoDB client in the lifespan handler
+    workers = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        reload=reload,
+        workers=1 if reload else workers,
+        loop="uvloop",
+        http="httptools",
+        log_level=os.getenv("UVICORN_LOG_LEVEL", "warning"),
+        access_log=False,
+    )
@@ -1,31 +1,26 @@
-import math
 import uuid
 from datetime import datetime, timezone
 from typing import Dict, Any, Tuple
-import re
-from decimal import Decimal
 
-
-PLATE_PATTERNS = [
-    r'^\d{3}-\d{2}-\d{3}$',
-    r'^\d{3}-\d{3}-\d{3}$',
-    r'^\d{2}-\d{3}-\d{2}$'
-]
+BLOCK_SECONDS = 15 * 60
+FEE_CENTS_PER_BLOCK = 250
 
 def generate_ticket_id() -> str:
-    """Generate a unique ticket ID"""
-    return str(uuid.uuid4())
+    """Generate a unique ticket ID (32 hex chars, no hyphens)"""
+    return uuid.uuid4().hex
 
-def get_current_time() -> str:
-    """Get current UTC time in ISO 8601 format"""
-    return datetime.now(timezone.utc).isoformat()
+def get_current_timestamp() -> Tuple[str, int]:
+    """Get current UTC time in ISO 8601 format and as whole epoch seconds"""
+    now = datetime.now(timezone.utc)
+    return now.isoformat(), int(now.timestamp())
 
-def validate_license_plate_format(plate: str) -> bool:
-    return any(re.match(p, plate) for p in PLATE_PATTERNS)
+def iso_to_epoch(time_str: str) -> int:
+    """Convert an ISO 8601 timestamp to whole epoch seconds"""
+    return int(datetime.fromisoformat(time_str).timestamp())
 
-def calculate_parking_fee(entry_time_str: str, exit_time_str: str) -> Tuple[float, Dict[str, Any]]:
+def calculate_parking_fee(entry_epoch: int, exit_epoch: int) -> Tuple[int, Dict[str, Any]]:
     """
-    Calculate the parking fee based on entry and exit times
+    Calculate the parking fee based on entry and exit epoch seconds
 
     Rules:
     1. First 15 min block is always charged
@@ -34,30 +29,22 @@ def calculate_parking_fee(entry_time_str: str, exit_time_str: str) -> Tuple[floa
     4. Partial blocks are rounded up
 
     Returns:
-        Tuple containing the fee amount and a dictionary with calculation details
+        Tuple containing the fee in integer cents and a dictionary with calculation details
     """
-    entry_time = datetime.fromisoformat(entry_time_str)
-    exit_time = datetime.fromisoformat(exit_time_str)
-
-    # Calculate duration in minutes
-    duration_seconds = (exit_time - entry_time).total_seconds()
-    duration_minutes = duration_seconds / 60
-    duration_hours = duration_minutes / 60
-    blocks = max(1, math.ceil(duration_minutes / 15))
-
-    base_fee = blocks * 2.5
-    fee = base_fee
-    fee = Decimal(str(fee))
+    # Clamp: entry and exit may be stamped by hosts with slightly skewed clocks
+    duration_seconds = max(0, exit_epoch - entry_epoch)
+    # Integer ceiling division; no float round-trip through math.ceil
+    blocks = max(1, (duration_seconds + BLOCK_SECONDS - 1) // BLOCK_SECONDS)
+    fee_cents = blocks * FEE_CENTS_PER_BLOCK
 
     # Prepare calculation details
     details = {
-        "entry_time": entry_time_str,
-        "exit_time": exit_time_str,
-        "duration_minutes": round(duration_minutes, 2),
-        "duration_hours": round(duration_hours, 2),
+        "entry_epoch": entry_epoch,
+        "exit_epoch": exit_epoch,
+        "duration_minutes": round(duration_seconds / 60, 2),
         "fifteen_min_blocks": blocks,
-        "fee_amount": fee,
+        "fee_cents": fee_cents,
         "currency": "USD"
     }
 
-    return fee, details
+    return fee_cents, details
@@ -7,6 +7,7 @@ STACK_NAME="parking-lot-system"
 STAGE="dev"
 INSTANCE_TYPE="t2.micro"
 DOCKER_IMAGE="aelka/cloud-computing-hw1:latest"
+PLATE_GUARDS_BACKFILLED="${PLATE_GUARDS_BACKFILLED:-true}"  # false while a pre-guard table awaits backfill_plate_guards.py
 SSH_LOCATION=$(curl -s https://checkip.amazonaws.com)/32  # Auto-detect current IP for SSH access
 
 # Check required parameters
@@ -37,7 +38,8 @@ aws cloudformation deploy \
       DockerImage="$DOCKER_IMAGE" \
       Stage="$STAGE" \
       InstanceType="$INSTANCE_TYPE" \
-      SSHLocation="$SSH_LOCATION"
+      SSHLocation="$SSH_LOCATION" \
+      PlateGuardsBackfilled="$PLATE_GUARDS_BACKFILLED"
 
 echo "Stack creation started, waiting for completion..."
 
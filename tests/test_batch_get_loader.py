@@ -0,0 +1,123 @@
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+from db import MAX_BATCH_GET_ATTEMPTS, MAX_BATCH_GET_KEYS, _BatchGetLoader  # noqa: E402
+
+TABLE = "parking-tickets"
+
+
+def raw_ticket(ticket_id):
+    return {"ticket_id": {"S": ticket_id}, "payment_status": {"S": "active"}}
+
+
+class FakeDynamoDB:
+    """
+    Answers batch_get_item from `items`. Keys in `throttled` come back as
+    UnprocessedKeys for the first `throttle_calls` requests.
+    """
+
+    def __init__(self, items=(), throttled=(), throttle_calls=0, error=None):
+        self.items = {ticket_id: raw_ticket(ticket_id) for ticket_id in items}
+        self.throttled = set(throttled)
+        self.throttle_calls = throttle_calls
+        self.error = error
+        self.calls = []
+
+    async def batch_get_item(self, RequestItems):
+        request = RequestItems[TABLE]
+        keys = [key["ticket_id"]["S"] for key in request["Keys"]]
+        self.calls.append(keys)
+        await asyncio.sleep(0)
+        if self.error is not None:
+            raise self.error
+
+        throttled = []
+        if len(self.calls) <= self.throttle_calls:
+            throttled = [k for k in keys if k in self.throttled]
+        resp = {
+            "Responses": {
+                TABLE: [self.items[k] for k in keys if k in self.items and k not in throttled]
+            },
+            "UnprocessedKeys": {},
+        }
+        if throttled:
+            resp["UnprocessedKeys"] = {
+                TABLE: {**request, "Keys": [{"ticket_id": {"S": k}} for k in throttled]}
+            }
+        return resp
+
+
+class BatchGetLoaderTest(unittest.IsolatedAsyncioTestCase):
+    def loader(self, client, window=0.001):
+        return _BatchGetLoader(client, TABLE, window)
+
+    async def test_concurrent_gets_share_one_request(self):
+        client = FakeDynamoDB(items=["a", "b"])
+        loader = self.loader(client)
+
+        results = await asyncio.gather(loader.get("a"), loader.get("b"), loader.get("missing"))
+
+        self.assertEqual(client.calls, [["a", "b", "missing"]])
+        self.assertEqual(results, [raw_ticket("a"), raw_ticket("b"), None])
+
+    async def test_duplicate_keys_are_requested_once(self):
+        client = FakeDynamoDB(items=["a"])
+        loader = self.loader(client)
+
+        results = await asyncio.gather(loader.get("a"), loader.get("a"))
+
+        self.assertEqual(client.calls, [["a"]])
+        self.assertEqual(results, [raw_ticket("a"), raw_ticket("a")])
+
+    async def test_full_batch_flushes_without_waiting_for_window(self):
+        ticket_ids = [f"t{i}" for i in range(MAX_BATCH_GET_KEYS)]
+        client = FakeDynamoDB(items=ticket_ids)
+        loader = self.loader(client, window=60)
+
+        results = await asyncio.wait_for(
+            asyncio.gather(*(loader.get(t) for t in ticket_ids)), timeout=1
+        )
+
+        self.assertEqual(client.calls, [ticket_ids])
+        self.assertEqual(results, [raw_ticket(t) for t in ticket_ids])
+
+    async def test_unprocessed_keys_are_retried(self):
+        client = FakeDynamoDB(items=["a", "b"], throttled=["b"], throttle_calls=1)
+        loader = self.loader(client)
+
+        results = await asyncio.gather(loader.get("a"), loader.get("b"))
+
+        self.assertEqual(client.calls, [["a", "b"], ["b"]])
+        self.assertEqual(results, [raw_ticket("a"), raw_ticket("b")])
+
+    async def test_keys_still_unprocessed_after_max_attempts_fail(self):
+        client = FakeDynamoDB(items=["a", "b"], throttled=["b"], throttle_calls=MAX_BATCH_GET_ATTEMPTS)
+        loader = self.loader(client)
+
+        a, b = await asyncio.gather(loader.get("a"), loader.get("b"), return_exceptions=True)
+
+        self.assertEqual(len(client.calls), MAX_BATCH_GET_ATTEMPTS)
+        self.assertEqual(a, raw_ticket("a"))
+        self.assertIsInstance(b, ClientError)
+        self.assertEqual(b.response["Error"]["Code"], "ProvisionedThroughputExceededException")
+
+    async def test_request_error_reaches_every_caller(self):
+        error = ClientError({"Error": {"Code": "InternalServerError", "Message": "boom"}}, "BatchGetItem")
+        client = FakeDynamoDB(items=["a"], error=error)
+        loader = self.loader(client)
+
+        results = await asyncio.gather(
+            loader.get("a"), loader.get("a"), loader.get("b"), return_exceptions=True
+        )
+
+        self.assertEqual(results, [error, error, error])
+
+
+if __name__ == "__main__":
+    unittest.main()
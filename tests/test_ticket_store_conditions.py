@@ -0,0 +1,162 @@
+import sys
+import unittest
+from pathlib import Path
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "app"))
+
+from db import (  # noqa: E402
+    DynamoDBTicketStore,
+    PlateAlreadyParked,
+    conditional_check_item,
+    is_conditional_check_failure,
+)
+
+PLATE = "123-45-678"
+
+
+def cancelled(*reasons):
+    """A TransactionCanceledException as DynamoDB reports it, one reason per item"""
+    return ClientError(
+        {
+            "Error": {"Code": "TransactionCanceledException", "Message": "Transaction cancelled"},
+            "CancellationReasons": list(reasons),
+        },
+        "TransactWriteItems",
+    )
+
+
+def condition_failed(item=None):
+    response = {"Error": {"Code": "ConditionalCheckFailedException", "Message": "The conditional request failed"}}
+    if item is not None:
+        response["Item"] = item
+    return ClientError(response, "UpdateItem")
+
+
+def raw_ticket(ticket_id, payment_status):
+    return {
+        "ticket_id": {"S": ticket_id},
+        "license_plate": {"S": PLATE},
+        "payment_status": {"S": payment_status},
+    }
+
+
+RAW_GUARD = {"ticket_id": {"S": f"PLATE#{PLATE}"}, "active_ticket_id": {"S": "T2"}}
+
+
+class FakeDynamoDB:
+    """Records write calls and fails them with the given errors"""
+
+    def __init__(self, transact_error=None, update_error=None):
+        self.transact_error = transact_error
+        self.update_error = update_error
+        self.transact_calls = []
+        self.update_calls = []
+
+    async def transact_write_items(self, TransactItems):
+        self.transact_calls.append(TransactItems)
+        if self.transact_error is not None:
+            raise self.transact_error
+        return {}
+
+    async def update_item(self, **params):
+        self.update_calls.append(params)
+        if self.update_error is not None:
+            raise self.update_error
+        return {}
+
+
+class UpdateTicketExitTest(unittest.IsolatedAsyncioTestCase):
+    def store(self, client):
+        store = DynamoDBTicketStore()
+        store.client = client
+        return store
+
+    async def exit_ticket(self, store):
+        await store.update_ticket_exit("T1", PLATE, "2026-01-01T10:00:00+00:00", 1767261600, 250)
+
+    async def test_missing_guard_closes_ticket_in_the_transaction(self):
+        client = FakeDynamoDB()
+
+        await self.exit_ticket(self.store(client))
+
+        self.assertEqual(len(client.transact_calls), 1)
+        delete = client.transact_calls[0][1]["Delete"]
+        self.assertIn("attribute_not_exists(ticket_id)", delete["ConditionExpression"])
+        self.assertEqual(client.update_calls, [])
+
+    async def test_guard_held_by_other_ticket_closes_ticket_alone(self):
+        client = FakeDynamoDB(
+            transact_error=cancelled({"Code": "None"}, {"Code": "ConditionalCheckFailed"})
+        )
+
+        await self.exit_ticket(self.store(client))
+
+        self.assertEqual(len(client.update_calls), 1)
+        update = client.update_calls[0]
+        self.assertEqual(update["Key"], {"ticket_id": {"S": "T1"}})
+        self.assertEqual(update["ConditionExpression"], "payment_status = :active")
+
+    async def test_ticket_closed_by_the_fallback_race_is_reported(self):
+        closed = raw_ticket("T1", "pending_payment")
+        client = FakeDynamoDB(
+            transact_error=cancelled({"Code": "None"}, {"Code": "ConditionalCheckFailed"}),
+            update_error=condition_failed(closed),
+        )
+
+        with self.assertRaises(ClientError) as ctx:
+            await self.exit_ticket(self.store(client))
+
+        self.assertTrue(is_conditional_check_failure(ctx.exception))
+        self.assertEqual(conditional_check_item(ctx.exception)["payment_status"], "pending_payment")
+
+    async def test_ticket_already_closed_is_reported_not_retried(self):
+        closed = raw_ticket("T1", "pending_payment")
+        client = FakeDynamoDB(
+            transact_error=cancelled({"Code": "ConditionalCheckFailed", "Item": closed}, {"Code": "None"})
+        )
+
+        with self.assertRaises(ClientError) as ctx:
+            await self.exit_ticket(self.store(client))
+
+        self.assertEqual(client.update_calls, [])
+        self.assertTrue(is_conditional_check_failure(ctx.exception))
+        self.assertEqual(conditional_check_item(ctx.exception)["payment_status"], "pending_payment")
+
+    async def test_closed_ticket_with_reused_guard_is_not_retried(self):
+        paid = raw_ticket("T1", "paid")
+        client = FakeDynamoDB(
+            transact_error=cancelled(
+                {"Code": "ConditionalCheckFailed", "Item": paid},
+                {"Code": "ConditionalCheckFailed"},
+            )
+        )
+
+        with self.assertRaises(ClientError) as ctx:
+            await self.exit_ticket(self.store(client))
+
+        self.assertEqual(client.update_calls, [])
+        self.assertEqual(conditional_check_item(ctx.exception)["payment_status"], "paid")
+
+
+class GuardConditionFailureTest(unittest.IsolatedAsyncioTestCase):
+    def test_guard_row_is_not_reported_as_a_ticket(self):
+        error = cancelled({"Code": "ConditionalCheckFailed", "Item": RAW_GUARD}, {"Code": "None"})
+
+        self.assertTrue(is_conditional_check_failure(error))
+        self.assertIsNone(conditional_check_item(error))
+
+    async def test_taken_guard_on_entry_raises_plate_already_parked(self):
+        store = DynamoDBTicketStore()
+        store.plate_guards_backfilled = True
+        store.client = FakeDynamoDB(
+            transact_error=cancelled({"Code": "ConditionalCheckFailed"}, {"Code": "None"})
+        )
+
+        with self.assertRaises(PlateAlreadyParked):
+            await store.create_ticket("T3", PLATE, "2026-01-01T10:00:00+00:00", 1767261600, "382")
+
+
+if __name__ == "__main__":
+    unittest.main()